@@ -7,7 +7,9 @@ class Settings(BaseSettings):
     IMAP_USERNAME: str
     IMAP_PASSWORD: str
     SSL_VERIFY: bool = True
-    LOG_LEVEL: str = "INFO"
+    LOG_LEVEL: str = "WARNING"
+    IMAP_POOL_SIZE: int = 4
+    IMAP_KEEPALIVE_INTERVAL: int = 300
     
     class Config:
         env_file = ".env"
@@ -0,0 +1,30 @@
+# app/logging_conf.py
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+import logging
+import queue
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+@contextmanager
+def configure_logging(level: str = "WARNING"):
+    """Route root logging through a queue at the given level for the lifetime of the app.
+
+    Records are written by a background thread so handler I/O never blocks the
+    event loop.
+    """
+    log_queue = queue.Queue(-1)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    queue_handler = QueueHandler(log_queue)
+
+    root_logger = logging.getLogger()
+    root_logger.setLevel(level)
+    root_logger.addHandler(queue_handler)
+    listener.start()
+    try:
+        yield
+    finally:
+        root_logger.removeHandler(queue_handler)
+        listener.stop()
@@ -1,27 +1,56 @@
 # app/main.py
 from fastapi import FastAPI, HTTPException, Query, Depends
-from fastapi.responses import Response
+from fastapi.responses import StreamingResponse
 from typing import List, Optional
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from urllib.parse import quote
+import asyncio
 import mimetypes
 from datetime import datetime
 import logging
 
 from .models import EmailResponse
-from .services import ImapService
+from .services import ImapConnectionPool, ImapService, valid_header_name
 from .config import Settings
+from .logging_conf import configure_logging
 
-# Configure logging
-logging.basicConfig(
-    level=logging.DEBUG,  # Set to DEBUG to see all parameter values
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="IMAP REST API")
-
-def get_settings():
+@lru_cache
+def get_settings() -> Settings:
     return Settings()
 
+@lru_cache
+def get_connection_pool() -> ImapConnectionPool:
+    settings = get_settings()
+    return ImapConnectionPool(
+        max_size=settings.IMAP_POOL_SIZE,
+        keepalive_interval=settings.IMAP_KEEPALIVE_INTERVAL
+    )
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    with configure_logging(get_settings().LOG_LEVEL):
+        pool = get_connection_pool()
+        keepalive = asyncio.create_task(pool.keepalive())
+        yield
+        keepalive.cancel()
+        await pool.close_all()
+
+app = FastAPI(title="IMAP REST API", lifespan=lifespan)
+
+def imap_date(value: Optional[str], name: str) -> Optional[str]:
+    """Convert a YYYY-MM-DD (or DD-Mon-YYYY) query date to IMAP's DD-Mon-YYYY"""
+    if not value:
+        return None
+    for date_format in ("%Y-%m-%d", "%d-%b-%Y"):
+        try:
+            return datetime.strptime(value, date_format).strftime("%d-%b-%Y")
+        except ValueError:
+            continue
+    raise HTTPException(status_code=422, detail=f"Invalid {name} '{value}', expected YYYY-MM-DD")
+
 @app.get("/emails/", response_model=List[EmailResponse])
 async def get_emails(
     start_date: Optional[str] = Query(None, description="Start date in YYYY-MM-DD format"),
@@ -30,34 +59,55 @@ async def get_emails(
     subject: Optional[str] = Query(None, description="Subject contains text"),
     mailbox: str = Query("INBOX", description="Mailbox to search in"),
     limit: int = Query(1, description="Maximum number of emails to return", gt=0),  # Changed default to 1
-    settings: Settings = Depends(get_settings)
+    headers: Optional[List[str]] = Query(None, description="Headers to include in the response (all when omitted)"),
+    since_uid: Optional[int] = Query(None, description="Only return emails with a UID greater than this", ge=0),
+    include_content: bool = Query(True, description="Include text and HTML bodies"),
+    include_attachments: bool = Query(True, description="Include attachment metadata"),
+    settings: Settings = Depends(get_settings),
+    pool: ImapConnectionPool = Depends(get_connection_pool)
 ):
     """Retrieve emails with optional filtering"""
-    logger.debug(f"API received request with limit={limit}")  # Add debug log
+    logger.debug("API received request with limit=%s", limit)
+    # Reject malformed dates before an IMAP connection is checked out
+    start_date = imap_date(start_date, "start_date")
+    end_date = imap_date(end_date, "end_date")
+    invalid_headers = [name for name in headers or [] if not valid_header_name(name)]
+    if invalid_headers:
+        raise HTTPException(status_code=422, detail=f"Invalid header names: {', '.join(invalid_headers)}")
     try:
-        imap_service = ImapService(settings)
+        imap_service = ImapService(settings, pool)
         return await imap_service.get_emails(
             start_date=start_date,
             end_date=end_date,
             sender=sender,
             subject=subject,
             mailbox=mailbox,
-            limit=limit  # Explicitly pass limit
+            limit=limit,  # Explicitly pass limit
+            headers=headers,
+            since_uid=since_uid,
+            want_bodies=include_content,
+            want_attachments=include_attachments
         )
     except Exception as e:
-        logger.error(f"Failed to retrieve emails: {str(e)}")
+        logger.error("Failed to retrieve emails: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
     
+def content_disposition(filename: str) -> str:
+    """Attachment header with an ASCII fallback and the RFC 5987 UTF-8 filename"""
+    fallback = filename.encode('ascii', 'replace').decode().replace('"', '').replace('\\', '')
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
 @app.get("/emails/{message_id}/attachments/{filename}")
 async def get_attachment(
     message_id: str,
     filename: str,
     mailbox: str = Query("INBOX", description="Mailbox containing the email"),
-    settings: Settings = Depends(get_settings)
+    settings: Settings = Depends(get_settings),
+    pool: ImapConnectionPool = Depends(get_connection_pool)
 ):
     """Download a specific attachment from an email"""
     try:
-        imap_service = ImapService(settings)
+        imap_service = ImapService(settings, pool)
         result = await imap_service.get_attachment(message_id, filename, mailbox)
         
         if not result:
@@ -69,13 +119,16 @@ async def get_attachment(
         if not content_type or content_type == "application/octet-stream":
             content_type, _ = mimetypes.guess_type(filename)
             
-        return Response(
-            content=content,
+        # Stream the attachment as it is fetched instead of buffering it
+        return StreamingResponse(
+            content,
             media_type=content_type or "application/octet-stream",
             headers={
-                "Content-Disposition": f"attachment; filename={filename}"
+                "Content-Disposition": content_disposition(filename)
             }
         )
-        
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
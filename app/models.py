@@ -1,5 +1,5 @@
 # app/models.py
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, Field
 from typing import Optional, List, Dict
 from datetime import datetime
 
@@ -11,6 +11,9 @@ class EmailAttachment(BaseModel):
 
 class EmailResponse(BaseModel):
     message_id: str
+    # UIDs stay stable across sessions while UIDVALIDITY is unchanged
+    uid: Optional[int] = None
+    uidvalidity: Optional[int] = None
     subject: str
     sender: str
     recipients: List[str] = Field(default_factory=list)
@@ -1,95 +1,587 @@
 # app/services.py
+import asyncio
+import base64
+import codecs
 import imaplib
 import email
+import quopri
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from itertools import takewhile
 import mimetypes
 from email.header import decode_header
+from email.parser import BytesHeaderParser
 from email.utils import parsedate_to_datetime
-from typing import List, Optional, Dict, Tuple
+from typing import Any, AsyncIterator, Callable, Iterator, List, NamedTuple, Optional, Dict, Tuple
+from urllib.parse import unquote_to_bytes
 import logging
 from datetime import datetime
 import re
 from .models import EmailResponse, EmailAttachment, MailboxResponse
 from .config import Settings
 
+logger = logging.getLogger(__name__)
+
+# RFC 5322 field-name characters that are also valid in an IMAP atom, so the
+# name can go into HEADER.FIELDS unquoted; ( ) [ ] { } " \ % * are excluded
+_HEADER_NAME_RE = re.compile(r"[!#$&'+,./0-9;<=>?@A-Z^_`a-z|~-]+")
+
+# Line breaks and anything else outside the base64 alphabet are skipped
+_BASE64_JUNK_RE = re.compile(rb'[^A-Za-z0-9+/=]')
+
+# Parsers keep no state between calls, so one instance serves every thread
+_HEADER_PARSER = BytesHeaderParser()
+
+
+def _quote_imap(value: str, literal_plus: bool = True) -> bytes:
+    """Encode a caller-supplied string as a single IMAP astring argument
+
+    ASCII values become quoted strings. Anything else is sent as a
+    non-synchronizing literal ({N+}, RFC 7888), since imaplib cannot wait for
+    continuations in the middle of a command; servers without LITERAL+ get
+    UTF-8 inside the quoted string instead. Line breaks never reach the wire.
+    """
+    data = re.sub(r'[\r\n]+', ' ', value).encode('utf-8')
+    if data.isascii() or not literal_plus:
+        return b'"' + data.replace(b'\\', b'\\\\').replace(b'"', b'\\"') + b'"'
+    return b'{%d+}\r\n' % len(data) + data
+
+
+def _supports_literal_plus(connection: imaplib.IMAP4) -> bool:
+    return bool({'LITERAL+', 'LITERAL-'} & set(getattr(connection, 'capabilities', ())))
+
+
+def valid_header_name(name: str) -> bool:
+    """Whether a header name can be requested through HEADER.FIELDS"""
+    return bool(_HEADER_NAME_RE.fullmatch(name))
+
+
+_FETCH_TOKEN_RE = re.compile(rb"""
+    \s*(?:
+        (?P<open>\() |
+        (?P<close>\)) |
+        "(?P<quoted>(?:[^"\\]|\\.)*)" |
+        \{(?P<literal>\d+)\}$ |
+        (?P<atom>[^\s()"\[]+(?:\[[^\]]*\](?:<[\d.]+>)?)?)
+    )""", re.VERBOSE)
+_OPEN = object()
+_CLOSE = object()
+
+
+def _fetch_tokens(data: List[Any]) -> Iterator[Any]:
+    """Tokenize raw imaplib FETCH data, splicing literals back in where they were announced"""
+    for item in data:
+        if item is None:
+            continue
+        text, literal = item if isinstance(item, tuple) else (item, None)
+        text = text.strip()
+        pos = 0
+        while pos < len(text):
+            match = _FETCH_TOKEN_RE.match(text, pos)
+            if not match:
+                raise ValueError(f"Unexpected FETCH data: {text[pos:pos + 50]!r}")
+            pos = match.end()
+            if match.group('open'):
+                yield _OPEN
+            elif match.group('close'):
+                yield _CLOSE
+            elif match.group('quoted') is not None:
+                yield re.sub(rb'\\(.)', rb'\1', match.group('quoted'))
+            elif match.group('literal'):
+                if literal is None:
+                    raise ValueError("FETCH literal announced but not received")
+                yield literal
+                literal = None
+            else:
+                atom = match.group('atom')
+                yield None if atom.upper() == b'NIL' else atom
+
+
+def _read_list(tokens: Iterator[Any]) -> List[Any]:
+    """Read tokens up to the matching close paren into a nested list"""
+    items = []
+    for token in tokens:
+        if token is _CLOSE:
+            return items
+        items.append(_read_list(tokens) if token is _OPEN else token)
+    raise ValueError("Unterminated list in FETCH response")
+
+
+def parse_fetch_response(data: List[Any], key: Optional[str] = None) -> Dict[bytes, Dict[str, Any]]:
+    """Parse imaplib FETCH data into {message number: {ATTRIBUTE: value}}
+
+    With key='UID' responses are keyed by UID instead, skipping unsolicited
+    FETCH responses that carry none.
+    """
+    messages: Dict[bytes, Dict[str, Any]] = {}
+    tokens = _fetch_tokens(data)
+    for number in tokens:
+        if not isinstance(number, bytes) or next(tokens, None) is not _OPEN:
+            raise ValueError(f"Malformed FETCH response for message {number!r}")
+        items = _read_list(tokens)
+        attributes = {name.decode('ascii').upper(): value for name, value in zip(items[::2], items[1::2])}
+        if key is not None:
+            number = attributes.get(key)
+            if number is None:
+                continue
+        messages.setdefault(number, {}).update(attributes)
+    return messages
+
+
+class BodyPart(NamedTuple):
+    """Leaf MIME part described by BODYSTRUCTURE"""
+    section: str
+    content_type: str
+    params: Dict[str, str]
+    encoding: str
+    size: int
+    disposition: Optional[str]
+    filename: Optional[str]
+    content_id: Optional[str]
+
+
+def _to_str(value: Any) -> Optional[str]:
+    return value.decode('utf-8', errors='replace') if isinstance(value, bytes) else None
+
+
+# RFC 2231 parameter names: name* (extended), name*0, name*1* ... (continuations)
+_RFC2231_NAME_RE = re.compile(r'(?P<name>[^*]+)\*(?:(?P<index>\d+)(?P<encoded>\*)?)?')
+
+
+def _join_rfc2231(pieces: List[Tuple[int, str, bool]]) -> str:
+    """Join RFC 2231 continuations and decode the charset'language'%XX form"""
+    charset = None
+    data = b''
+    for position, (_, value, encoded) in enumerate(sorted(pieces, key=lambda piece: piece[0])):
+        if not encoded:
+            data += value.encode('utf-8')
+            continue
+        if position == 0 and value.count("'") >= 2:
+            charset, _, value = value.split("'", 2)
+        data += unquote_to_bytes(value)
+    return data.decode(_text_codec(charset or None), errors='replace')
+
+
+def _param_dict(params: Any) -> Dict[str, str]:
+    """Turn a BODYSTRUCTURE parameter list into a dict with lowercase keys
+
+    RFC 2231 extended and continued parameters are decoded and stored under
+    their plain name, unless the plain name is also present.
+    """
+    if not isinstance(params, list):
+        return {}
+    result: Dict[str, str] = {}
+    continued: Dict[str, List[Tuple[int, str, bool]]] = {}
+    for name, value in zip(params[::2], params[1::2]):
+        if not isinstance(name, bytes):
+            continue
+        name, value = _to_str(name).lower(), _to_str(value) or ''
+        match = _RFC2231_NAME_RE.fullmatch(name)
+        if match:
+            index = match.group('index')
+            encoded = index is None or bool(match.group('encoded'))
+            continued.setdefault(match.group('name'), []).append((int(index or 0), value, encoded))
+        else:
+            result[name] = value
+    for name, pieces in continued.items():
+        result.setdefault(name, _join_rfc2231(pieces))
+    return result
+
+
+def _part_filename(params: Dict[str, str], disposition_params: Dict[str, str]) -> Optional[str]:
+    for source in (disposition_params, params):
+        for key in ('filename', 'name'):
+            if source.get(key):
+                return source[key]
+    return None
+
+
+def parse_bodystructure(structure: List[Any], section: str = '') -> List[BodyPart]:
+    """Flatten a parsed BODYSTRUCTURE into its leaf parts with IMAP section numbers"""
+    if structure and isinstance(structure[0], list):
+        # Children come first; the subtype and extension data (boundary
+        # parameters, disposition, language) follow them
+        parts = []
+        for index, child in enumerate(takewhile(lambda item: isinstance(item, list), structure)):
+            child_section = f"{section}.{index + 1}" if section else str(index + 1)
+            parts.extend(parse_bodystructure(child, child_section))
+        return parts
+
+    maintype, subtype = (_to_str(value) or '' for value in structure[:2])
+    content_type = f"{maintype}/{subtype}".lower()
+    params = _param_dict(structure[2])
+
+    # Extension data follows the type-specific fields: lines for text,
+    # envelope/body/lines for message/rfc822
+    if content_type == 'message/rfc822':
+        disposition_index = 11
+    elif maintype.lower() == 'text':
+        disposition_index = 9
+    else:
+        disposition_index = 8
+    disposition, disposition_params = None, {}
+    if len(structure) > disposition_index and isinstance(structure[disposition_index], list):
+        disposition = (_to_str(structure[disposition_index][0]) or '').lower()
+        disposition_params = _param_dict(structure[disposition_index][1])
+
+    return [BodyPart(
+        section=section or '1',
+        content_type=content_type,
+        params=params,
+        encoding=(_to_str(structure[5]) or '7bit').lower(),
+        size=int(structure[6] or 0),
+        disposition=disposition,
+        filename=_part_filename(params, disposition_params),
+        content_id=_to_str(structure[3])
+    )]
+
+
+def _decoded_size(part: BodyPart) -> int:
+    """Estimate a part's decoded size from its encoded octet count"""
+    if part.encoding == 'base64':
+        # 3 bytes per 4 characters, ignoring the CRLF ending each 76-character line
+        return (part.size - 2 * (part.size // 78)) * 3 // 4
+    return part.size
+
+
+@lru_cache(maxsize=64)
+def _text_codec(charset: Optional[str]) -> str:
+    """Normalized codec name for a MIME charset; unknown names and non-text codecs fall back to UTF-8"""
+    try:
+        name = codecs.lookup(charset or 'utf-8').name
+        # codecs.lookup also finds non-text codecs such as base64, hex and
+        # rot13; bytes.decode rejects those with LookupError too (empty input
+        # would skip the codec entirely)
+        b'a'.decode(name, errors='ignore')
+    except LookupError:
+        return 'utf-8'
+    return name
+
+
+def _decode_text(data: bytes, charset: Optional[str]) -> str:
+    """Decode a text part with its charset, replacing undecodable bytes"""
+    return data.decode(_text_codec(charset), errors='replace')
+
+
+def decode_body_part(data: bytes, part: BodyPart) -> str:
+    """Undo the transfer encoding of a fetched part and decode it with its charset"""
+    decoder = _TransferDecoder(part.encoding)
+    data = decoder.feed(data) + decoder.flush()
+    return _decode_text(data, part.params.get('charset', '').lower() or None)
+
+
+def _b64decode_lenient(data: bytes) -> bytes:
+    """Decode unpadded base64, dropping a trailing character that carries no complete byte"""
+    usable = len(data) - (1 if len(data) % 4 == 1 else 0)
+    return base64.b64decode(data[:usable] + b'=' * (-usable % 4))
+
+
+class _TransferDecoder:
+    """Incrementally undo a part's Content-Transfer-Encoding across arbitrary chunk boundaries
+
+    Base64 is decoded leniently, like email's own decoder: characters outside
+    the alphabet are skipped and missing or stray padding is tolerated.
+    """
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        self._pending = b''
+
+    def feed(self, data: bytes) -> bytes:
+        if self.encoding == 'base64':
+            data = self._pending + _BASE64_JUNK_RE.sub(b'', data)
+            # Padding ends a run of base64; some senders concatenate several
+            *complete, tail = re.split(rb'=+', data)
+            usable = len(tail) - len(tail) % 4
+            self._pending = tail[usable:]
+            return b''.join(map(_b64decode_lenient, complete)) + base64.b64decode(tail[:usable])
+        if self.encoding == 'quoted-printable':
+            # Only decode complete lines so escapes and soft breaks are never split
+            data = self._pending + data
+            end = data.rfind(b'\n') + 1
+            self._pending = data[end:]
+            return quopri.decodestring(data[:end])
+        return data
+
+    def flush(self) -> bytes:
+        data, self._pending = self._pending, b''
+        if not data:
+            return b''
+        if self.encoding == 'base64':
+            return _b64decode_lenient(data)
+        return quopri.decodestring(data)
+
+
+class LazyDecodedHeaders(Mapping):
+    """Read-only view of a message's headers that decodes each value on first access"""
+
+    def __init__(self, msg: email.message.Message, decode: Callable[[Optional[str]], str]):
+        # One pass over the header list; like msg[name], the first occurrence wins
+        self._raw: Dict[str, str] = {}
+        self._names: Dict[str, str] = {}
+        for name, value in msg.items():
+            key = name.lower()
+            if key not in self._names:
+                self._names[key] = name
+                self._raw[name] = value
+        self._decode = decode
+        self._decoded: Dict[str, str] = {}
+
+    def __getitem__(self, name: str) -> str:
+        name = self._names[name.lower()]
+        if name not in self._decoded:
+            self._decoded[name] = self._decode(self._raw[name])
+        return self._decoded[name]
+
+    def __contains__(self, name: object) -> bool:
+        return isinstance(name, str) and name.lower() in self._names
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._raw)
+
+    def __len__(self) -> int:
+        return len(self._raw)
+
+    def subset(self, names: Optional[List[str]] = None) -> Dict[str, str]:
+        """Decode the requested headers, or all of them when names is None"""
+        if names is None:
+            return dict(self)
+        return {self._names[name.lower()]: self[name] for name in names if name in self}
+
+
+class _TTLCache:
+    """Small thread-safe LRU mapping whose entries expire after ttl seconds"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Any) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Any, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+class ImapConnectionPool:
+    """Process-wide pool of authenticated IMAP connections keyed by (host, username)"""
+
+    # Idle connections older than this are checked with NOOP before being handed out
+    VALIDATE_AFTER = 60
+
+    def __init__(self, max_size: int = 4, keepalive_interval: int = 5 * 60):
+        # Upper bound on open connections per key, whether idle or checked out
+        self.max_size = max_size
+        self.keepalive_interval = keepalive_interval
+        self.logger = logger
+        self._idle: Dict[Tuple[str, str], List[Tuple[imaplib.IMAP4, float]]] = {}
+        self._semaphores: Dict[Tuple[str, str], asyncio.Semaphore] = {}
+
+    def _slots(self, key: Tuple[str, str]) -> asyncio.Semaphore:
+        """Semaphore held by whoever owns one of key's connections outside the idle list"""
+        if key not in self._semaphores:
+            self._semaphores[key] = asyncio.Semaphore(self.max_size)
+        return self._semaphores[key]
+
+    def _connect(self, settings: Settings) -> imaplib.IMAP4:
+        """Create and return a logged-in IMAP connection"""
+        self.logger.info("Connecting to IMAP server %s:%s", settings.IMAP_HOST, settings.IMAP_PORT)
+        try:
+            if settings.SSL_VERIFY:
+                self.logger.debug("Using SSL connection")
+                connection = imaplib.IMAP4_SSL(
+                    host=settings.IMAP_HOST,
+                    port=settings.IMAP_PORT
+                )
+            else:
+                self.logger.debug("Using non-SSL connection")
+                connection = imaplib.IMAP4(
+                    host=settings.IMAP_HOST,
+                    port=settings.IMAP_PORT
+                )
+
+            self.logger.debug("Attempting login...")
+            connection.login(settings.IMAP_USERNAME, settings.IMAP_PASSWORD)
+            self.logger.info("Successfully logged in to IMAP server")
+            # imaplib keeps the capabilities announced before login; servers may
+            # advertise more, such as LITERAL+, once the session is authenticated
+            _, capabilities = connection.capability()
+            connection.capabilities = tuple(capabilities[-1].decode('ascii', 'replace').upper().split())
+            return connection
+        except Exception as e:
+            self.logger.error("Failed to connect to IMAP server: %s", e)
+            raise
+
+    def _close(self, connection: imaplib.IMAP4) -> None:
+        """Log out, ignoring errors from connections that are already dead"""
+        try:
+            connection.logout()
+        except Exception as e:
+            self.logger.debug("Ignoring error on logout: %s", e)
+
+    def _is_alive(self, connection: imaplib.IMAP4) -> bool:
+        try:
+            status, _ = connection.noop()
+            return status == 'OK'
+        except (imaplib.IMAP4.error, OSError):
+            return False
+
+    async def _checkout(self, key: Tuple[str, str]) -> Optional[imaplib.IMAP4]:
+        """Pop a live idle connection for key, dropping any that turn out to be dead"""
+        # The list is looked up again after every await: keepalive may have
+        # taken connections out of it in the meantime
+        while self._idle.get(key):
+            # Popping happens on the event loop, so no two requests get the same connection
+            connection, released_at = self._idle[key].pop()
+            if time.monotonic() - released_at < self.VALIDATE_AFTER or await asyncio.to_thread(self._is_alive, connection):
+                return connection
+            self.logger.info("Discarding stale IMAP connection")
+            await asyncio.to_thread(self._close, connection)
+        return None
+
+    async def _release(self, key: Tuple[str, str], connection: imaplib.IMAP4) -> None:
+        idle = self._idle.setdefault(key, [])
+        if len(idle) >= self.max_size:
+            await asyncio.to_thread(self._close, connection)
+            return
+        idle.append((connection, time.monotonic()))
+
+    @asynccontextmanager
+    async def acquire(self, settings: Settings) -> AsyncIterator[imaplib.IMAP4]:
+        """Check out a connection for exclusive use, returning it to the pool afterwards"""
+        key = (settings.IMAP_HOST, settings.IMAP_USERNAME)
+        # Bursts wait here rather than opening more sessions than the server allows
+        async with self._slots(key):
+            connection = await self._checkout(key)
+            if connection is None:
+                connection = await asyncio.to_thread(self._connect, settings)
+            try:
+                yield connection
+            except (imaplib.IMAP4.abort, OSError):
+                # The session is broken; the next acquire reconnects
+                self.logger.warning("Dropping IMAP connection after connection failure")
+                await asyncio.to_thread(self._close, connection)
+                raise
+            except Exception:
+                # Command-level failures leave the session usable
+                await self._release(key, connection)
+                raise
+            except asyncio.CancelledError:
+                # A cancelled to_thread call keeps running in its worker, so logging out
+                # here would use the socket from two threads; drop the connection instead
+                # and let it close once the worker lets go
+                self.logger.warning("Dropping IMAP connection after cancelled request")
+                raise
+            except BaseException:
+                # Closed early, e.g. an attachment stream abandoned between chunks; no
+                # worker thread is using the connection, so it can be logged out
+                await asyncio.to_thread(self._close, connection)
+                raise
+            else:
+                await self._release(key, connection)
+
+    async def keepalive(self) -> None:
+        """Periodically NOOP idle connections so servers don't drop them"""
+        while True:
+            await asyncio.sleep(self.keepalive_interval)
+            for key in list(self._idle):
+                # Check each connection once, oldest first. Like a checkout, it is
+                # popped from the pool and holds a slot while its NOOP runs, so no
+                # request can get it and none opens a connection in its place.
+                for _ in range(len(self._idle.get(key, ()))):
+                    async with self._slots(key):
+                        if not self._idle.get(key):
+                            break
+                        connection = self._idle[key].pop(0)[0]
+                        if await asyncio.to_thread(self._is_alive, connection):
+                            await self._release(key, connection)
+                        else:
+                            self.logger.info("Discarding IMAP connection that failed keepalive")
+                            await asyncio.to_thread(self._close, connection)
+
+    async def close_all(self) -> None:
+        """Log out every idle connection, in parallel and off the event loop"""
+        connections = [connection for idle in self._idle.values() for connection, _ in idle]
+        self._idle.clear()
+        await asyncio.gather(*(asyncio.to_thread(self._close, connection) for connection in connections))
+
+
 class ImapService:
-    def __init__(self, settings: Settings):
+    # Encoded bytes requested per FETCH when streaming an attachment
+    ATTACHMENT_FETCH_SIZE = 1024 * 1024
+
+    # UID SEARCH results shared by all requests, for repeated paging and polling
+    _search_cache = _TTLCache(maxsize=1024, ttl=30)
+
+    # Message-ID -> UID for recently listed emails, so attachment downloads skip
+    # the header SEARCH; UIDs stay valid for as long as UIDVALIDITY does
+    _uid_cache = _TTLCache(maxsize=4096, ttl=24 * 60 * 60)
+
+    def __init__(self, settings: Settings, pool: ImapConnectionPool):
         self.settings = settings
-        self.setup_logging()
-
-    def setup_logging(self):
-        self.logger = logging.getLogger(__name__)
-        self.logger.setLevel(self.settings.LOG_LEVEL)
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        if not self.logger.handlers:
-            handler = logging.StreamHandler()
-            handler.setFormatter(formatter)
-            self.logger.addHandler(handler)
-
-    def decode_header_value(self, value: Optional[str]) -> str:
+        self.pool = pool
+        # Level and handlers come from the root logger set up by logging_conf
+        self.logger = logger
+
+    @staticmethod
+    def decode_header_value(value: Optional[str]) -> str:
         """Decode email header value safely"""
         if not value:
             return ""
+        if not isinstance(value, str):
+            value = str(value)
+        # Most headers carry no RFC 2047 encoded words and need no decoding
+        if '=?' not in value:
+            return value
+        return ImapService._decode_encoded_words(value)
+
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def _decode_encoded_words(value: str) -> str:
+        """Decode a header value containing encoded words, memoized since they repeat across a mailbox"""
         try:
-            self.logger.debug(f"Decoding header value: {value[:100]}...")
+            logger.debug("Decoding header value: %.100s...", value)
             decoded_header = decode_header(value)
             parts = []
             for part, charset in decoded_header:
                 if isinstance(part, bytes):
                     try:
                         if charset:
-                            self.logger.debug(f"Decoding with charset: {charset}")
+                            logger.debug("Decoding with charset: %s", charset)
                             parts.append(part.decode(charset))
                         else:
                             parts.append(part.decode('utf-8', errors='replace'))
                     except:
-                        self.logger.debug("Fallback to ASCII decoding")
+                        logger.debug("Fallback to ASCII decoding")
                         parts.append(part.decode('ascii', errors='replace'))
                 else:
                     parts.append(str(part))
             result = " ".join(parts)
-            self.logger.debug(f"Decoded result: {result[:100]}...")
+            logger.debug("Decoded result: %.100s...", result)
             return result
         except Exception as e:
-            self.logger.warning(f"Error decoding header: {str(e)}")
+            logger.warning("Error decoding header: %s", e)
             return str(value)
 
-    def create_imap_connection(self) -> imaplib.IMAP4:
-        """Create and return an IMAP connection"""
-        self.logger.info(f"Connecting to IMAP server {self.settings.IMAP_HOST}:{self.settings.IMAP_PORT}")
-        try:
-            if self.settings.SSL_VERIFY:
-                self.logger.debug("Using SSL connection")
-                connection = imaplib.IMAP4_SSL(
-                    host=self.settings.IMAP_HOST,
-                    port=self.settings.IMAP_PORT
-                )
-            else:
-                self.logger.debug("Using non-SSL connection")
-                connection = imaplib.IMAP4(
-                    host=self.settings.IMAP_HOST,
-                    port=self.settings.IMAP_PORT
-                )
-            
-            self.logger.debug("Attempting login...")
-            connection.login(self.settings.IMAP_USERNAME, self.settings.IMAP_PASSWORD)
-            self.logger.info("Successfully logged in to IMAP server")
-            return connection
-        except Exception as e:
-            self.logger.error(f"Failed to connect to IMAP server: {str(e)}")
-            raise
-
-    def get_email_addresses(self, header_value: Optional[str]) -> List[str]:
-        """Extract email addresses from header value"""
-        if not header_value:
-            return []
-        
-        self.logger.debug(f"Extracting email addresses from: {header_value[:100]}...")
-        decoded_header = self.decode_header_value(header_value)
-        email_pattern = r'[\w\.-]+@[\w\.-]+\.\w+'
-        addresses = re.findall(email_pattern, decoded_header)
-        self.logger.debug(f"Found email addresses: {addresses}")
-        return addresses
-
     # app/services.py - Updated get_emails method
 
     async def get_emails(
@@ -99,374 +591,363 @@ class ImapService:
         sender: Optional[str] = None,
         subject: Optional[str] = None,
         mailbox: str = "INBOX",
-        limit: int = 1
+        limit: int = 1,
+        headers: Optional[List[str]] = None,
+        since_uid: Optional[int] = None,
+        want_bodies: bool = True,
+        want_attachments: bool = True
     ) -> List[EmailResponse]:
         """Retrieve emails with optional filtering"""
-        self.logger.info(f"Starting email retrieval from mailbox: {mailbox} with limit {limit}")
+        self.logger.debug("Starting email retrieval from mailbox: %s with limit %s", mailbox, limit)
         
-        connection = self.create_imap_connection()
-        try:
-            connection.select(mailbox)
-            self.logger.info(f"Selected mailbox: {mailbox}")
-
-            # Build search criteria
-            search_criteria = []
-            if start_date:
-                search_criteria.append(f'SINCE {start_date}')
-            if end_date:
-                search_criteria.append(f'BEFORE {end_date}')
-            if sender:
-                search_criteria.append(f'FROM "{sender}"')
-
-            search_string = ' '.join(search_criteria) if search_criteria else 'ALL'
-            self.logger.info(f"Search criteria: {search_string}")
-            
-            _, message_numbers = connection.search(None, search_string)
-            message_nums = message_numbers[0].split()
-            message_nums.reverse()  # Newest first
-            message_nums = message_nums[:limit]  # Apply limit
-
-            emails = []
-            for num in message_nums:
-                try:
-                    # First fetch structure and basic info
-                    _, response = connection.fetch(num, '(BODYSTRUCTURE FLAGS)')
-                    if response[0]:
-                        self.logger.debug(f"Message structure: {response[0]}")
-
-                    # Then fetch the full message
-                    _, msg_data = connection.fetch(num, '(RFC822)')
-                    email_body = msg_data[0][1]
-                    msg = email.message_from_bytes(email_body)
-
-                    # Log the complete message structure
-                    self.logger.debug(f"""
-                    Processing Message:
-                    Subject: {msg['subject']}
-                    Content-Type: {msg.get_content_type()}
-                    Has Payload: {msg.is_multipart()}
-                    Parts: {len(msg.get_payload()) if msg.is_multipart() else 1}
-                    """)
-
-                    text_content = None
-                    html_content = None
-                    attachments = []
-
-                    # Process all parts
-                    for part in msg.walk():
-                        self.logger.debug(f"""
-                        Part Info:
-                        Content-Type: {part.get_content_type()}
-                        Content-Disposition: {part.get('Content-Disposition')}
-                        Filename: {part.get_filename()}
-                        Is Multipart: {part.is_multipart()}
-                        """)
-
-                        if part.is_multipart():
-                            continue
-
-                        filename = part.get_filename()
-                        content_type = part.get_content_type()
-
-                        # Check for attachment using multiple methods
-                        if filename or \
-                        part.get('Content-Disposition', '').startswith('attachment') or \
-                        content_type.startswith(('application/', 'image/', 'video/', 'audio/')):
-                            
-                            if not filename:
-                                ext = mimetypes.guess_extension(content_type) or ''
-                                filename = f"attachment{ext}"
-
-                            self.logger.info(f"Found attachment: {filename} ({content_type})")
-                            
-                            # Get the payload
-                            payload = part.get_payload(decode=True)
-                            if payload is None:
-                                payload = part.get_payload().encode('utf-8')
-
-                            attachments.append(EmailAttachment(
-                                filename=filename,
-                                content_type=content_type,
-                                size=len(payload),
-                                content_id=part.get('Content-ID')
-                            ))
-                        elif content_type == 'text/plain':
-                            text_content = part.get_payload(decode=True).decode('utf-8', errors='replace')
-                        elif content_type == 'text/html':
-                            html_content = part.get_payload(decode=True).decode('utf-8', errors='replace')
-
-                    # Create EmailResponse
-                    email_response = EmailResponse(
-                        message_id=msg['message-id'] or "",
-                        subject=self.decode_header_value(msg['subject']),
-                        sender=self.decode_header_value(msg['from']),
-                        recipients=self.get_email_addresses(msg['to']),
-                        date=parsedate_to_datetime(msg['date']) if msg['date'] else datetime.now(),
-                        mailbox=mailbox,
-                        flags=[],
-                        text_content=text_content,
-                        html_content=html_content,
-                        size=len(email_body),
-                        attachments=attachments,
-                        headers={k: self.decode_header_value(v) for k, v in msg.items()}
-                    )
-
-                    if subject and subject.lower() not in email_response.subject.lower():
-                        continue
-
-                    emails.append(email_response)
-                    
-                    if len(emails) >= limit:
-                        break
+        async with self.pool.acquire(self.settings) as connection:
+            # imaplib blocks on network I/O, so the whole exchange runs in a worker thread
+            return await asyncio.to_thread(
+                self.get_emails_sync,
+                connection,
+                start_date=start_date,
+                end_date=end_date,
+                sender=sender,
+                subject=subject,
+                mailbox=mailbox,
+                limit=limit,
+                headers=headers,
+                since_uid=since_uid,
+                want_bodies=want_bodies,
+                want_attachments=want_attachments
+            )
 
-                except Exception as e:
-                    self.logger.error(f"Error processing email {num}: {str(e)}", exc_info=True)
+    def get_emails_sync(
+        self,
+        connection: imaplib.IMAP4,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        sender: Optional[str] = None,
+        subject: Optional[str] = None,
+        mailbox: str = "INBOX",
+        limit: int = 1,
+        headers: Optional[List[str]] = None,
+        since_uid: Optional[int] = None,
+        want_bodies: bool = True,
+        want_attachments: bool = True
+    ) -> List[EmailResponse]:
+        """Blocking part of get_emails, run on an already checked-out connection"""
+        _, exists = connection.select(mailbox)
+        self.logger.debug("Selected mailbox: %s", mailbox)
+        _, uidvalidity = connection.response('UIDVALIDITY')
+        uidvalidity = int(uidvalidity[0]) if uidvalidity and uidvalidity[0] else None
+        _, uidnext = connection.response('UIDNEXT')
+
+        # Build search criteria, one token per argument; imaplib sends arguments
+        # verbatim, so caller-supplied strings are always quoted here
+        literal_plus = _supports_literal_plus(connection)
+        search_criteria: List[Any] = []
+        if start_date:
+            search_criteria += ['SINCE', start_date]
+        if end_date:
+            search_criteria += ['BEFORE', end_date]
+        if sender:
+            search_criteria += ['FROM', _quote_imap(sender, literal_plus)]
+        if subject:
+            # SEARCH SUBJECT is a case-insensitive substring match, like the old local filter
+            search_criteria += ['SUBJECT', _quote_imap(subject, literal_plus)]
+        if since_uid is not None:
+            search_criteria += ['UID', f'{since_uid + 1}:*']
+        search_criteria = search_criteria or ['ALL']
+        charset_args = [] if all(isinstance(c, str) or c.isascii() for c in search_criteria) else ['CHARSET', 'UTF-8']
+        self.logger.debug("Search criteria: %s", search_criteria)
+
+        # A new message or an expunge changes EXISTS or UIDNEXT, so cached results
+        # are only reused while the mailbox is unchanged
+        cache_key = (
+            self.settings.IMAP_HOST, self.settings.IMAP_USERNAME, mailbox,
+            uidvalidity, uidnext[0] if uidnext else None, exists[0] if exists else None,
+            tuple(charset_args + search_criteria)
+        )
+        message_uids = self._search_cache.get(cache_key)
+        if message_uids is None:
+            # UIDs, unlike sequence numbers, survive expunges and new mail between requests
+            _, data = connection.uid('SEARCH', *charset_args, *search_criteria)
+            message_uids = data[0].split()
+            self._search_cache.set(cache_key, message_uids)
+        message_nums = list(message_uids)
+        if since_uid is not None:
+            # "n:*" always matches the highest UID, even when it is below n
+            message_nums = [uid for uid in message_nums if int(uid) > since_uid]
+        message_nums.reverse()  # Newest first
+        message_nums = message_nums[:limit]  # Apply limit
+
+        # Fetch metadata and MIME structure for all candidates in a single round trip;
+        # message bodies and attachments are not downloaded
+        fetch_items = ['FLAGS', 'RFC822.SIZE', 'ENVELOPE']
+        if want_bodies or want_attachments:
+            fetch_items.append('BODYSTRUCTURE')
+        header_item = self.header_fetch_item(headers)
+        if header_item:
+            fetch_items.append(header_item)
+        fetched = self.fetch_messages(connection, message_nums, f"({' '.join(fetch_items)})")
+
+        emails = []
+        body_parts = []
+        for num in message_nums:
+            try:
+                if num not in fetched:
                     continue
+                email_response, parts = self.parse_fetched_message(
+                    fetched[num], mailbox, headers, uidvalidity, want_attachments
+                )
+                emails.append(email_response)
+                body_parts.append((num, email_response, parts))
+                if email_response.message_id:
+                    self._uid_cache.set(self.uid_cache_key(mailbox, uidvalidity, email_response.message_id), num)
 
-            return emails
+            except (imaplib.IMAP4.abort, OSError):
+                raise
+            except Exception as e:
+                self.logger.error("Error processing email %s: %s", num, e, exc_info=True)
+                continue
 
-        finally:
-            connection.logout()
+        # Attachment metadata comes from BODYSTRUCTURE alone; bodies cost a second FETCH
+        if want_bodies:
+            self.fetch_body_content(connection, body_parts)
+        return emails
 
-    def parse_email_message(self, msg: email.message.Message, mailbox: str, flags: List[str]) -> EmailResponse:
-        """Parse email message into EmailResponse model"""
+    def fetch_messages(
+        self,
+        connection: imaplib.IMAP4,
+        message_nums: List[bytes],
+        message_parts: str
+    ) -> Dict[bytes, Dict[str, Any]]:
+        """UID FETCH several messages with one command, falling back to one FETCH per message"""
+        if not message_nums:
+            return {}
+        _, msg_data = connection.uid('FETCH', b','.join(message_nums), message_parts)
         try:
-            self.logger.debug("Starting email parsing")
-            
-            # Parse date
-            date_str = msg["date"]
+            return parse_fetch_response(msg_data, key='UID')
+        except ValueError as e:
+            self.logger.warning("Could not parse batched FETCH response, fetching individually: %s", e)
+
+        fetched = {}
+        for num in message_nums:
             try:
-                date = parsedate_to_datetime(date_str)
-                self.logger.debug(f"Parsed date: {date}")
-            except:
-                self.logger.warning("Failed to parse date, using current time")
-                date = datetime.now()
-
-            # Get content and attachments
-            self.logger.debug("Extracting content and attachments")
-            text_content, html_content, attachments = self.get_content_parts(msg)
-
-            email_response = EmailResponse(
-                message_id=msg["message-id"] or "",
-                subject=self.decode_header_value(msg["subject"]),
-                sender=self.decode_header_value(msg["from"]),
-                recipients=self.get_email_addresses(msg["to"]),
-                date=date,
-                mailbox=mailbox,
-                flags=flags,
-                text_content=text_content,
-                html_content=html_content,
-                size=len(str(msg).encode('utf-8')),
-                attachments=attachments,
-                headers={k: self.decode_header_value(v) for k, v in msg.items()}
-            )
-            
-            self.logger.debug(f"Successfully parsed email: {email_response.subject}")
-            return email_response
-            
-        except Exception as e:
-            self.logger.error(f"Error parsing email: {str(e)}", exc_info=True)
-            return EmailResponse(
-                message_id=msg["message-id"] or "",
-                subject="[Error: Could not parse email]",
-                sender="",
-                date=datetime.now(),
-                mailbox=mailbox,
-                flags=flags,
-                size=0
-            )
+                _, msg_data = connection.uid('FETCH', num, message_parts)
+                fetched.update(parse_fetch_response(msg_data, key='UID'))
+            except ValueError as e:
+                self.logger.error("Error fetching email %s: %s", num, e)
+        return fetched
+
+    def header_fetch_item(self, headers: Optional[List[str]]) -> Optional[str]:
+        """FETCH item for the headers included in the response, None if none are wanted"""
+        if headers is None:
+            return 'BODY.PEEK[HEADER]'
+        names = [name for name in headers if valid_header_name(name)]
+        if not names:
+            return None
+        return f"BODY.PEEK[HEADER.FIELDS ({' '.join(names)})]"
+
+    def parse_addresses(self, addresses: Any) -> List[Tuple[str, str]]:
+        """Turn ENVELOPE address structures into (display name, address) pairs"""
+        result = []
+        for name, _, mailbox, host in addresses or []:
+            if mailbox is None or host is None:
+                continue  # Group syntax markers
+            result.append((self.decode_header_value(_to_str(name)), f"{_to_str(mailbox)}@{_to_str(host)}"))
+        return result
+
+    def is_attachment(self, part: BodyPart) -> bool:
+        return bool(
+            part.filename or
+            part.disposition == 'attachment' or
+            part.content_type.startswith(('application/', 'image/', 'video/', 'audio/', 'message/'))
+        )
+
+    def attachment_filename(self, part: BodyPart) -> str:
+        """Decoded filename of an attachment part, with a generated name for unnamed parts"""
+        if part.filename:
+            return self.decode_header_value(part.filename)
+        ext = mimetypes.guess_extension(part.content_type) or ''
+        return f"attachment{ext}"
+
+    def parse_fetched_message(
+        self,
+        attributes: Dict[str, Any],
+        mailbox: str,
+        headers: Optional[List[str]] = None,
+        uidvalidity: Optional[int] = None,
+        want_attachments: bool = True
+    ) -> Tuple[EmailResponse, Dict[str, BodyPart]]:
+        """Build an EmailResponse from FETCH metadata, returning the body parts still to download"""
+        envelope = attributes['ENVELOPE']
+        try:
+            date = parsedate_to_datetime(_to_str(envelope[0]))
+        except (TypeError, ValueError):
+            self.logger.warning("Failed to parse date, using current time")
+            date = datetime.now()
+        senders = [f"{name} <{address}>" if name else address for name, address in self.parse_addresses(envelope[2])]
+
+        # Attachment metadata comes straight from BODYSTRUCTURE; only text parts are fetched later
+        body_parts: Dict[str, BodyPart] = {}
+        attachments = []
+        structure = attributes.get('BODYSTRUCTURE')
+        for part in parse_bodystructure(structure) if structure else []:
+            if self.is_attachment(part):
+                if not want_attachments:
+                    continue
+                attachments.append(EmailAttachment.model_construct(
+                    filename=self.attachment_filename(part),
+                    content_type=part.content_type,
+                    size=_decoded_size(part),
+                    content_id=part.content_id
+                ))
+            elif part.content_type == 'text/plain':
+                body_parts.setdefault('text_content', part)
+            elif part.content_type == 'text/html':
+                body_parts.setdefault('html_content', part)
+
+        # Only the header block is parsed; no MIME tree is built for listings
+        header_data = next((value for name, value in attributes.items() if name.startswith('BODY[HEADER')), None)
+        selected_headers = {}
+        if header_data:
+            decoded_headers = LazyDecodedHeaders(_HEADER_PARSER.parsebytes(header_data), self.decode_header_value)
+            selected_headers = decoded_headers.subset(headers)
+
+        # Values come from our own parsing, so skip re-validating them
+        email_response = EmailResponse.model_construct(
+            message_id=_to_str(envelope[9]) or "",
+            uid=int(attributes['UID']) if attributes.get('UID') else None,
+            uidvalidity=uidvalidity,
+            subject=self.decode_header_value(_to_str(envelope[1])),
+            sender=senders[0] if senders else "",
+            recipients=[address for _, address in self.parse_addresses(envelope[5])],
+            date=date,
+            mailbox=mailbox,
+            flags=[flag.decode() for flag in attributes.get('FLAGS', [])],
+            size=int(attributes.get('RFC822.SIZE') or 0),
+            attachments=attachments,
+            headers=selected_headers
+        )
+        return email_response, body_parts
+
+    def fetch_body_content(
+        self,
+        connection: imaplib.IMAP4,
+        pending: List[Tuple[bytes, EmailResponse, Dict[str, BodyPart]]]
+    ) -> None:
+        """Download text and HTML parts, batching messages whose parts share section numbers"""
+        groups: Dict[Tuple[str, ...], List[bytes]] = {}
+        for num, _, body_parts in pending:
+            sections = tuple(sorted(part.section for part in body_parts.values()))
+            if sections:
+                groups.setdefault(sections, []).append(num)
+
+        fetched: Dict[bytes, Dict[str, Any]] = {}
+        for sections, message_nums in groups.items():
+            fetch_items = ' '.join(f'BODY.PEEK[{section}]' for section in sections)
+            fetched.update(self.fetch_messages(connection, message_nums, f'({fetch_items})'))
+
+        for num, email_response, body_parts in pending:
+            for field, part in body_parts.items():
+                data = fetched.get(num, {}).get(f'BODY[{part.section}]')
+                if data is None:
+                    continue
+                try:
+                    setattr(email_response, field, decode_body_part(data, part))
+                except Exception as e:
+                    # One malformed body must not fail the whole listing; the field stays None
+                    self.logger.error("Error decoding part %s of email %s: %s", part.section, num, e)
 
     async def get_attachment(
         self,
         message_id: str,
         attachment_filename: str,
         mailbox: str = "INBOX"
-    ) -> Optional[Tuple[bytes, str, str]]:
-        """Retrieve a specific attachment from an email"""
-        connection = self.create_imap_connection()
-        try:
-            status, messages = connection.select(mailbox)
-            if status != 'OK':
-                raise Exception(f"Failed to select mailbox: {messages}")
-
-            # Search for the specific email
-            _, message_numbers = connection.search(None, f'HEADER "Message-ID" "{message_id}"')
-            message_nums = message_numbers[0].split()
-            
-            if not message_nums:
-                return None
-
-            # Get the email
-            _, msg_data = connection.fetch(message_nums[0], '(RFC822)')
-            email_body = msg_data[0][1]
-            msg = email.message_from_bytes(email_body)
-
-            # Look for the attachment
-            for part in msg.walk():
-                try:
-                    if part.is_multipart():
-                        continue
-
-                    filename = part.get_filename()
-                    if filename:
-                        filename = self.decode_header_value(filename)
-                        
-                        if filename == attachment_filename:
-                            content_type = part.get_content_type()
-                            payload = part.get_payload(decode=True)
-                            return payload, filename, content_type
-                            
-                except Exception as e:
-                    self.logger.error(f"Error processing attachment: {str(e)}")
-                    continue
-
+    ) -> Optional[Tuple[AsyncIterator[bytes], str, str]]:
+        """Locate an attachment and return a stream of its decoded bytes"""
+        stream = self.stream_attachment(message_id, attachment_filename, mailbox)
+        found = await anext(stream)
+        if found is None:
+            # Run the generator to completion so the connection goes back to the pool
+            await anext(stream, None)
             return None
+        filename, content_type = found
+        return stream, filename, content_type
 
-        finally:
-            connection.logout()
-
-
-
-
-    # Add this helper function to ImapService class
-    def debug_message_structure(self, msg: email.message.Message, prefix: str = '') -> None:
-        """Debug helper to print complete message structure"""
-        self.logger.info(f"""{prefix}Message Part:
-        Type: {msg.get_content_type()}
-        Filename: {msg.get_filename()}
-        Content-Disposition: {msg.get('Content-Disposition')}
-        Is Multipart: {msg.is_multipart()}
-        Headers: {dict(msg.items())}
-        """)
-        
-        if msg.is_multipart():
-            for idx, part in enumerate(msg.get_payload()):
-                self.logger.info(f"{prefix}Part {idx}:")
-                self.debug_message_structure(part, prefix + '    ')
-
-
-    def get_content_parts(self, msg: email.message.Message) -> Tuple[Optional[str], Optional[str], List[EmailAttachment]]:
-        """Extract text, HTML content and attachments from email message"""
-        text_content = None
-        html_content = None
-        attachments = []
-
-        def dump_structure(part, level=0):
-            """Debug helper to dump complete structure"""
-            indent = "  " * level
-            self.logger.info(f"""{indent}Part:
-    {indent}  Type: {part.get_content_type()}
-    {indent}  Filename: {part.get_filename()}
-    {indent}  Disposition: {part.get('Content-Disposition')}
-    {indent}  Headers: {dict(part.items())}
-    {indent}  Is Multipart: {part.is_multipart()}""")
-            
-            if part.is_multipart():
-                for subpart in part.get_payload():
-                    dump_structure(subpart, level + 1)
-            else:
-                payload_type = type(part.get_payload())
-                payload_length = len(part.get_payload(decode=True) or b'') if payload_type != str else len(part.get_payload())
-                self.logger.info(f"{indent}  Payload Type: {payload_type}, Length: {payload_length}")
-
-        # First dump complete structure
-        self.logger.info("=== Full Message Structure ===")
-        dump_structure(msg)
-        self.logger.info("=============================")
-
-        def process_part(part):
-            """Process individual message part"""
-            nonlocal text_content, html_content
-
-            if part.is_multipart():
-                for subpart in part.get_payload():
-                    process_part(subpart)
+    async def stream_attachment(
+        self,
+        message_id: str,
+        attachment_filename: str,
+        mailbox: str = "INBOX"
+    ) -> AsyncIterator[Any]:
+        """Yield (filename, content_type), or None if not found, then the decoded content in chunks"""
+        async with self.pool.acquire(self.settings) as connection:
+            found = await asyncio.to_thread(
+                self.find_attachment_sync, connection, message_id, attachment_filename, mailbox
+            )
+            if found is None:
+                yield None
                 return
+            num, part = found
+            yield attachment_filename, part.content_type
+
+            # The connection stays checked out while the client reads the stream
+            decoder = _TransferDecoder(part.encoding)
+            offset = 0
+            while True:
+                data = await asyncio.to_thread(self.fetch_part_chunk_sync, connection, num, part.section, offset)
+                offset += len(data)
+                decoded = decoder.feed(data)
+                if decoded:
+                    yield decoded
+                if len(data) < self.ATTACHMENT_FETCH_SIZE:
+                    break
+            decoded = decoder.flush()
+            if decoded:
+                yield decoded
+
+    def find_attachment_sync(
+        self,
+        connection: imaplib.IMAP4,
+        message_id: str,
+        attachment_filename: str,
+        mailbox: str = "INBOX"
+    ) -> Optional[Tuple[bytes, BodyPart]]:
+        """Find the message UID and BODYSTRUCTURE part of an attachment"""
+        status, messages = connection.select(mailbox)
+        if status != 'OK':
+            raise Exception(f"Failed to select mailbox: {messages}")
+        _, uidvalidity = connection.response('UIDVALIDITY')
+        uidvalidity = int(uidvalidity[0]) if uidvalidity and uidvalidity[0] else None
+        cache_key = self.uid_cache_key(mailbox, uidvalidity, message_id)
+
+        # Only the structure is fetched here; the content is streamed afterwards
+        uid = self._uid_cache.get(cache_key)
+        fetched = self.fetch_messages(connection, [uid], '(BODYSTRUCTURE)') if uid else {}
+        if uid not in fetched:
+            # Not listed recently, or expunged since: search for the specific email
+            _, message_uids = connection.uid(
+                'SEARCH', 'HEADER', 'Message-ID', _quote_imap(message_id, _supports_literal_plus(connection))
+            )
+            message_nums = message_uids[0].split()
+            if not message_nums:
+                return None
+            uid = message_nums[0]
+            fetched = self.fetch_messages(connection, [uid], '(BODYSTRUCTURE)')
+            if uid not in fetched:
+                return None
+            self._uid_cache.set(cache_key, uid)
 
-            content_type = part.get_content_type()
-            content_disp = str(part.get('Content-Disposition', '')).lower()
-            filename = part.get_filename()
-            maintype = part.get_content_maintype()
-            subtype = part.get_content_subtype()
-
-            self.logger.info(f"""
-    Processing Part:
-    Content-Type: {content_type}
-    Content-Disposition: {content_disp}
-    Filename: {filename}
-    Main/Sub Type: {maintype}/{subtype}
-    Headers: {dict(part.items())}
-            """)
-
-            # Check if this is an attachment
-            is_attachment = False
-            if content_disp and ('attachment' in content_disp or 'inline' in content_disp):
-                is_attachment = True
-                self.logger.info(f"Detected attachment via disposition: {content_disp}")
-            elif filename:
-                is_attachment = True
-                self.logger.info(f"Detected attachment via filename: {filename}")
-            elif maintype not in ['text', 'multipart']:
-                is_attachment = True
-                self.logger.info(f"Detected attachment via content type: {content_type}")
-
-            if is_attachment:
-                try:
-                    if not filename:
-                        ext = mimetypes.guess_extension(content_type) or ''
-                        filename = f"attachment{ext}"
-
-                    payload = part.get_payload(decode=True)
-                    if payload is None:
-                        payload = part.get_payload().encode('utf-8')
-
-                    size = len(payload)
-                    self.logger.info(f"Adding attachment: {filename} ({content_type}, {size} bytes)")
-
-                    attachments.append(EmailAttachment(
-                        filename=filename,
-                        content_type=content_type,
-                        size=size,
-                        content_id=part.get('Content-ID')
-                    ))
-                except Exception as e:
-                    self.logger.error(f"Error processing attachment {filename}: {str(e)}", exc_info=True)
-                return
+        for part in parse_bodystructure(fetched[uid]['BODYSTRUCTURE']):
+            if self.is_attachment(part) and self.attachment_filename(part) == attachment_filename:
+                return uid, part
 
-            # Handle text content
-            try:
-                if content_type == 'text/plain' and not text_content:
-                    payload = part.get_payload(decode=True)
-                    if payload:
-                        text_content = payload.decode('utf-8', errors='replace')
-                        self.logger.info("Extracted text/plain content")
-                elif content_type == 'text/html' and not html_content:
-                    payload = part.get_payload(decode=True)
-                    if payload:
-                        html_content = payload.decode('utf-8', errors='replace')
-                        self.logger.info("Extracted text/html content")
-            except Exception as e:
-                self.logger.error(f"Error processing {content_type} content: {str(e)}")
+        return None
 
-        # Process the message
-        try:
-            if msg.is_multipart():
-                self.logger.info("Processing multipart message")
-                for part in msg.get_payload():
-                    process_part(part)
-            else:
-                self.logger.info("Processing non-multipart message")
-                process_part(msg)
-        except Exception as e:
-            self.logger.error(f"Error in content processing: {str(e)}", exc_info=True)
-
-        # Log results
-        self.logger.info(f"""
-    Content Processing Results:
-    - Attachments Found: {len(attachments)}
-    - Attachment Details: {[(a.filename, a.content_type, a.size) for a in attachments]}
-    - Has Text Content: {bool(text_content)}
-    - Has HTML Content: {bool(html_content)}
-        """)
-
-        return text_content, html_content, attachments
\ No newline at end of file
+    def uid_cache_key(self, mailbox: str, uidvalidity: Optional[int], message_id: str) -> Tuple[Any, ...]:
+        return (self.settings.IMAP_HOST, self.settings.IMAP_USERNAME, mailbox, uidvalidity, message_id)
+
+    def fetch_part_chunk_sync(self, connection: imaplib.IMAP4, num: bytes, section: str, offset: int) -> bytes:
+        """Fetch one window of a part's encoded content"""
+        fetched = self.fetch_messages(
+            connection, [num], f'(BODY.PEEK[{section}]<{offset}.{self.ATTACHMENT_FETCH_SIZE}>)'
+        )
+        return fetched.get(num, {}).get(f'BODY[{section}]<{offset}>') or b''
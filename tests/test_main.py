@@ -0,0 +1,8 @@
+# tests/test_main.py
+from app.main import content_disposition
+
+
+def test_content_disposition_encodes_reserved_characters():
+    header = content_disposition('a/b;c "d".pdf')
+    assert header == "attachment; filename=\"a/b;c d.pdf\"; filename*=UTF-8''a%2Fb%3Bc%20%22d%22.pdf"
+    assert content_disposition('résumé.pdf').endswith("filename*=UTF-8''r%C3%A9sum%C3%A9.pdf")
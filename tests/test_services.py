@@ -0,0 +1,389 @@
+# tests/test_services.py
+import asyncio
+import base64
+import time
+
+import pytest
+
+from app import services
+from app.config import Settings
+from app.models import EmailResponse
+from app.services import (
+    BodyPart, ImapConnectionPool, ImapService, _quote_imap, _TransferDecoder,
+    decode_body_part, parse_bodystructure, parse_fetch_response, valid_header_name
+)
+
+# FETCH responses below are shaped as imaplib returns them from real servers,
+# including the extension data servers always append to BODYSTRUCTURE
+
+ALTERNATIVE = (
+    b'1 (UID 7 BODYSTRUCTURE (("text" "plain" ("charset" "utf-8") NIL NIL "quoted-printable" 12 1 NIL NIL NIL NIL)'
+    b'("text" "html" ("charset" "utf-8") NIL NIL "7bit" 20 1 NIL NIL NIL NIL)'
+    b' "alternative" ("boundary" "000000000000b1") NIL NIL NIL))'
+)
+
+MIXED_NESTED = (
+    b'2 (UID 8 BODYSTRUCTURE ((("text" "plain" ("charset" "UTF-8") NIL NIL "7bit" 5 1 NIL NIL NIL NIL)'
+    b'("text" "html" ("charset" "UTF-8") NIL NIL "7bit" 18 1 NIL NIL NIL NIL)'
+    b' "alternative" ("boundary" "b2") NIL NIL NIL)'
+    b'("application" "pdf" ("name" "doc.pdf") "<cid1@x>" NIL "base64" 4096 NIL'
+    b' ("attachment" ("filename" "doc.pdf" "size" "3000")) NIL NIL)'
+    b' "mixed" ("boundary" "b1") ("inline" NIL) NIL NIL))'
+)
+
+FORWARDED = (
+    b'3 (UID 9 BODYSTRUCTURE (("text" "plain" ("charset" "us-ascii") NIL NIL "7bit" 13 1 NIL NIL NIL NIL)'
+    b'("message" "rfc822" NIL NIL NIL "7bit" 300'
+    b' ("Mon, 1 Jan 2024 10:00:00 +0000" "Hi" (("A" NIL "a" "x.org")) (("A" NIL "a" "x.org"))'
+    b' (("A" NIL "a" "x.org")) NIL NIL NIL NIL "<m@x.org>")'
+    b' ("text" "plain" ("charset" "us-ascii") NIL NIL "7bit" 5 1 NIL NIL NIL NIL) 10 NIL'
+    b' ("attachment" ("filename" "fwd.eml")) NIL NIL)'
+    b' "mixed" ("boundary" "b3") NIL NIL NIL))'
+)
+
+SINGLE = b'4 (UID 10 BODYSTRUCTURE ("text" "plain" ("charset" "iso-8859-1") NIL NIL "quoted-printable" 42 2 NIL NIL NIL NIL))'
+
+RFC2231 = (
+    b'5 (UID 11 BODYSTRUCTURE (("text" "plain" ("charset" "utf-8") NIL NIL "7bit" 5 1 NIL NIL NIL NIL)'
+    b'("application" "pdf" ("name*" "utf-8\'\'r%C3%A9sum%C3%A9.pdf") NIL NIL "base64" 100 NIL'
+    b' ("attachment" ("filename*" "utf-8\'\'r%C3%A9sum%C3%A9.pdf")) NIL NIL)'
+    b' "mixed" ("boundary" "b4") NIL NIL NIL))'
+)
+
+RFC2231_CONTINUED = (
+    b'6 (UID 12 BODYSTRUCTURE (("text" "plain" ("charset" "utf-8") NIL NIL "7bit" 5 1 NIL NIL NIL NIL)'
+    b'("application" "pdf" NIL NIL NIL "base64" 100 NIL'
+    b' ("attachment" ("filename*1*" "sum%C3%A9" "filename*0*" "utf-8\'en\'r%C3%A9" "filename*2" ".pdf")) NIL NIL)'
+    b'("application" "pdf" ("name*" "bogus\'\'r%C3%A9.pdf") NIL NIL "base64" 100 NIL NIL NIL NIL)'
+    b' "mixed" ("boundary" "b5") NIL NIL NIL))'
+)
+
+
+def structure(response):
+    attributes = next(iter(parse_fetch_response([response], key='UID').values()))
+    return parse_bodystructure(attributes['BODYSTRUCTURE'])
+
+
+def test_multipart_extension_data_is_not_a_part():
+    parts = structure(ALTERNATIVE)
+    assert [(p.section, p.content_type) for p in parts] == [('1', 'text/plain'), ('2', 'text/html')]
+    assert parts[0].encoding == 'quoted-printable'
+    assert parts[0].params == {'charset': 'utf-8'}
+
+
+def test_nested_multipart_sections():
+    parts = structure(MIXED_NESTED)
+    assert [(p.section, p.content_type) for p in parts] == [
+        ('1.1', 'text/plain'), ('1.2', 'text/html'), ('2', 'application/pdf')
+    ]
+    attachment = parts[2]
+    assert attachment.disposition == 'attachment'
+    assert attachment.filename == 'doc.pdf'
+    assert attachment.content_id == '<cid1@x>'
+    assert attachment.size == 4096
+
+
+def test_message_rfc822_is_a_leaf():
+    parts = structure(FORWARDED)
+    assert [(p.section, p.content_type) for p in parts] == [('1', 'text/plain'), ('2', 'message/rfc822')]
+    assert parts[1].disposition == 'attachment'
+    assert parts[1].filename == 'fwd.eml'
+
+
+def test_single_part_message():
+    parts = structure(SINGLE)
+    assert len(parts) == 1
+    assert parts[0].section == '1'
+    assert parts[0].content_type == 'text/plain'
+    assert parts[0].params == {'charset': 'iso-8859-1'}
+    assert parts[0].disposition is None
+
+
+def test_rfc2231_filename():
+    parts = structure(RFC2231)
+    assert parts[1].filename == 'résumé.pdf'
+
+
+def test_rfc2231_continuations_and_unknown_charset():
+    parts = structure(RFC2231_CONTINUED)
+    assert parts[1].filename == 'résumé.pdf'
+    assert parts[2].filename == 'ré.pdf'
+
+
+def test_fetch_response_with_literals():
+    data = [
+        (b'12 (UID 40 RFC822.SIZE 120 BODY[HEADER.FIELDS (SUBJECT)] {17}', b'Subject: hello\r\n\r'),
+        b' FLAGS (\\Seen))',
+        (b'13 (UID 41 BODY[1]<0> {3}', b'abc'),
+        b')',
+    ]
+    fetched = parse_fetch_response(data, key='UID')
+    assert set(fetched) == {b'40', b'41'}
+    assert fetched[b'40']['BODY[HEADER.FIELDS (SUBJECT)]'] == b'Subject: hello\r\n\r'
+    assert fetched[b'40']['FLAGS'] == [b'\\Seen']
+    assert fetched[b'40']['RFC822.SIZE'] == b'120'
+    assert fetched[b'41']['BODY[1]<0>'] == b'abc'
+
+
+def test_unsolicited_fetch_without_uid_is_skipped():
+    fetched = parse_fetch_response([b'3 (FLAGS (\\Seen))', b'4 (UID 9 FLAGS ())'], key='UID')
+    assert list(fetched) == [b'9']
+
+
+def body_part(encoding, charset='utf-8'):
+    return BodyPart(
+        section='1', content_type='text/plain', params={'charset': charset}, encoding=encoding,
+        size=0, disposition=None, filename=None, content_id=None
+    )
+
+
+def test_decode_base64_body_with_bad_padding():
+    encoded = base64.b64encode('héllo wörld'.encode())
+    assert decode_body_part(encoded.rstrip(b'='), body_part('base64')) == 'héllo wörld'
+    assert decode_body_part(encoded[:-1] + b'\r\n', body_part('base64')).startswith('héllo w')
+    assert decode_body_part(b'aGk=\r\naGk=\r\nX', body_part('base64')) == 'hihi'
+
+
+def test_decode_quoted_printable_body():
+    assert decode_body_part(b'caf=C3=A9 =\r\nlatte', body_part('quoted-printable')) == 'café latte'
+
+
+def test_decode_body_ignores_non_text_charsets():
+    assert decode_body_part(b'caf\xc3\xa9', body_part('8bit', 'base64')) == 'café'
+    assert decode_body_part(b'caf\xc3\xa9', body_part('8bit', 'rot13')) == 'café'
+    assert decode_body_part(b'caf\xe9', body_part('8bit', 'latin-1')) == 'café'
+    assert decode_body_part(b'caf\xe9', body_part('8bit', 'no-such-charset')) == 'caf�'
+
+
+def test_transfer_decoder_across_chunks():
+    encoded = base64.encodebytes(bytes(range(256)) * 4)
+    decoder = _TransferDecoder('base64')
+    decoded = b''.join(decoder.feed(encoded[i:i + 7]) for i in range(0, len(encoded), 7)) + decoder.flush()
+    assert decoded == bytes(range(256)) * 4
+
+
+class StubConnection:
+    """Answers UID FETCH with canned responses"""
+
+    def __init__(self, responses):
+        self.responses = responses
+
+    def uid(self, command, message_set, items):
+        return 'OK', self.responses[message_set]
+
+
+def test_fetch_body_content_skips_undecodable_parts(monkeypatch):
+    service = ImapService(Settings(IMAP_USERNAME='user', IMAP_PASSWORD='secret'), ImapConnectionPool())
+    good = EmailResponse.model_construct(subject='good')
+    bad = EmailResponse.model_construct(subject='bad')
+    connection = StubConnection({b'1,2': [
+        (b'1 (UID 1 BODY[1] {5}', b'hello'), b')',
+        (b'2 (UID 2 BODY[1] {5}', b'b0rk!'), b')',
+    ]})
+
+    def decode(data, part):
+        if data == b'b0rk!':
+            raise ValueError("broken body")
+        return data.decode()
+
+    monkeypatch.setattr(services, 'decode_body_part', decode)
+    service.fetch_body_content(connection, [
+        (b'1', good, {'text_content': body_part('7bit')}),
+        (b'2', bad, {'text_content': body_part('7bit')}),
+    ])
+    assert good.text_content == 'hello'
+    assert bad.text_content is None
+
+
+def test_header_names_exclude_imap_specials():
+    for name in ('Subject', 'X-Spam-Status', 'List-Id', "X-Odd_Name#1"):
+        assert valid_header_name(name)
+    for name in ('Foo)', 'a(b', 'a[b', 'a]b', 'a{b', 'a}b', 'a"b', 'a\\b', 'a%b', 'a*b', 'a b', 'a:b', ''):
+        assert not valid_header_name(name)
+
+
+class RecordingConnection:
+    """Stands in for a pooled connection and records logouts"""
+
+    def __init__(self):
+        self.logged_out = False
+
+    def logout(self):
+        self.logged_out = True
+
+
+def test_cancelled_acquire_drops_connection_without_logout():
+    pool = ImapConnectionPool()
+    settings = Settings(IMAP_USERNAME='user', IMAP_PASSWORD='secret')
+    connection = RecordingConnection()
+    pool._idle[(settings.IMAP_HOST, settings.IMAP_USERNAME)] = [(connection, time.monotonic())]
+
+    async def cancelled_request():
+        async with pool.acquire(settings):
+            raise asyncio.CancelledError
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(cancelled_request())
+    assert not connection.logged_out
+    assert pool._idle[(settings.IMAP_HOST, settings.IMAP_USERNAME)] == []
+
+
+def test_keepalive_and_checkout_never_share_a_connection():
+    pool = ImapConnectionPool(keepalive_interval=0)
+    settings = Settings(IMAP_USERNAME='user', IMAP_PASSWORD='secret')
+    key = (settings.IMAP_HOST, settings.IMAP_USERNAME)
+    dead, idle = RecordingConnection(), RecordingConnection()
+    # The request validates the stale dead connection first; keepalive starts meanwhile
+    pool._idle[key] = [(idle, time.monotonic()), (dead, time.monotonic() - 3600)]
+    in_use, shared = set(), []
+
+    def use(connection):
+        if connection in in_use:
+            shared.append(connection)
+        in_use.add(connection)
+        time.sleep(0.05)
+        in_use.discard(connection)
+
+    def is_alive(connection):
+        use(connection)
+        return connection is not dead
+
+    pool._is_alive = is_alive
+    pool._connect = lambda settings: RecordingConnection()
+
+    async def request():
+        async with pool.acquire(settings) as connection:
+            await asyncio.to_thread(use, connection)
+            assert connection not in [pooled for pooled, _ in pool._idle[key]]
+
+    async def main():
+        keepalive = asyncio.create_task(pool.keepalive())
+        try:
+            await request()
+        finally:
+            keepalive.cancel()
+
+    asyncio.run(main())
+    assert shared == []
+
+
+def test_stream_closed_between_chunks_logs_out():
+    pool = ImapConnectionPool()
+    settings = Settings(IMAP_USERNAME='user', IMAP_PASSWORD='secret')
+    connection = RecordingConnection()
+    pool._idle[(settings.IMAP_HOST, settings.IMAP_USERNAME)] = [(connection, time.monotonic())]
+
+    async def stream():
+        async with pool.acquire(settings):
+            yield b'first chunk'
+            yield b'second chunk'
+
+    async def read_one_chunk():
+        chunks = stream()
+        await chunks.__anext__()
+        await chunks.aclose()
+
+    asyncio.run(read_one_chunk())
+    assert connection.logged_out
+    assert pool._idle[(settings.IMAP_HOST, settings.IMAP_USERNAME)] == []
+
+
+def test_pool_size_caps_concurrent_connections():
+    pool = ImapConnectionPool(max_size=2)
+    settings = Settings(IMAP_USERNAME='user', IMAP_PASSWORD='secret')
+    opened, in_use, peak = [], set(), []
+
+    def connect(settings):
+        opened.append(RecordingConnection())
+        return opened[-1]
+
+    pool._connect = connect
+
+    async def request():
+        async with pool.acquire(settings) as connection:
+            in_use.add(connection)
+            peak.append(len(in_use))
+            await asyncio.sleep(0.01)
+            in_use.discard(connection)
+
+    async def burst():
+        await asyncio.gather(*(request() for _ in range(5)))
+
+    asyncio.run(burst())
+    assert len(opened) == 2
+    assert max(peak) == 2
+
+
+def test_quote_imap_escapes_quoted_strings():
+    assert _quote_imap('report') == b'"report"'
+    assert _quote_imap('say "hi" \\ bye') == b'"say \\"hi\\" \\\\ bye"'
+    # A line break would end the command and let the rest run as a new one
+    assert _quote_imap('a"\r\nX LOGOUT') == b'"a\\" X LOGOUT"'
+    assert _quote_imap('a\r\n\r\nb', literal_plus=False) == b'"a b"'
+
+
+def test_quote_imap_sends_non_ascii_as_literal():
+    assert _quote_imap('café') == b'{5+}\r\ncaf\xc3\xa9'
+    assert _quote_imap('café\r\nX') == b'{7+}\r\ncaf\xc3\xa9 X'
+    # Without LITERAL+ the UTF-8 goes inside the quoted string
+    assert _quote_imap('"café"', literal_plus=False) == b'"\\"caf\xc3\xa9\\""'
+
+
+class SearchConnection:
+    """Mailbox whose EXISTS and UIDNEXT can change between requests; counts SEARCHes"""
+
+    def __init__(self):
+        self.capabilities = ('IMAP4REV1', 'LITERAL+')
+        self.exists, self.uidnext = b'3', b'104'
+        self.searches = []
+
+    def select(self, mailbox):
+        return 'OK', [self.exists]
+
+    def response(self, code):
+        return code, [{'UIDVALIDITY': b'7', 'UIDNEXT': self.uidnext}[code]]
+
+    def uid(self, command, *args):
+        self.searches.append(args)
+        return 'OK', [b'']
+
+
+def test_search_cache_misses_when_mailbox_changes(monkeypatch):
+    monkeypatch.setattr(ImapService, '_search_cache', services._TTLCache())
+    service = ImapService(Settings(IMAP_USERNAME='user', IMAP_PASSWORD='secret'), ImapConnectionPool())
+    connection = SearchConnection()
+
+    service.get_emails_sync(connection, subject='café')
+    service.get_emails_sync(connection, subject='café')
+    assert connection.searches == [('CHARSET', 'UTF-8', 'SUBJECT', b'{5+}\r\ncaf\xc3\xa9')]
+
+    service.get_emails_sync(connection, subject='report')
+    assert len(connection.searches) == 2
+
+    connection.exists = b'4'  # new message or expunge
+    service.get_emails_sync(connection, subject='report')
+    assert len(connection.searches) == 3
+
+    connection.uidnext = b'105'  # new message while another was expunged
+    service.get_emails_sync(connection, subject='report')
+    assert len(connection.searches) == 4
+
+
+class CapabilityConnection:
+    """Plain IMAP4 stand-in that announces LITERAL+ only after login"""
+
+    def __init__(self, host, port):
+        self.capabilities = ('IMAP4REV1', 'AUTH=PLAIN')
+
+    def login(self, username, password):
+        return 'OK', [b'Logged in']
+
+    def capability(self):
+        return 'OK', [b'IMAP4rev1 LITERAL+ IDLE']
+
+
+def test_connect_refreshes_capabilities_after_login(monkeypatch):
+    monkeypatch.setattr(services.imaplib, 'IMAP4', CapabilityConnection)
+    pool = ImapConnectionPool()
+    connection = pool._connect(Settings(IMAP_USERNAME='user', IMAP_PASSWORD='secret', SSL_VERIFY=False))
+    assert services._supports_literal_plus(connection)